@@ -30,31 +30,39 @@ This module provides a few things:
 
 
 import codecs
+import collections
 import datetime
 import functools
 import inspect
 import io
 import itertools
 import json
+import sys
+import threading
+import types
 import uuid
 from xmlrpc import client as xmlrpclib
 
 from oslo_utils import encodeutils
 from oslo_utils import importutils
-from oslo_utils import timeutils
-
-_ISO8601_DATE_FORMAT = '%Y-%m-%d'
 
 ipaddress = importutils.try_import("ipaddress")
 netaddr = importutils.try_import("netaddr")
+orjson = importutils.try_import("orjson")
+simdjson = importutils.try_import("simdjson")
 
 _nasty_type_tests = [inspect.ismodule, inspect.isclass, inspect.ismethod,
-                     inspect.isfunction, inspect.isgeneratorfunction,
-                     inspect.isgenerator, inspect.istraceback, inspect.isframe,
-                     inspect.iscode, inspect.isbuiltin, inspect.isroutine,
-                     inspect.isabstract]
+                     inspect.isfunction, inspect.isgenerator,
+                     inspect.istraceback, inspect.isframe, inspect.iscode,
+                     inspect.isbuiltin, inspect.isroutine, inspect.isabstract]
+
+# Outcome of the _nasty_type_tests per type, see _is_nasty().
+_nasty_types = {}
+_NASTY_TYPES_MAX = 1024
 
 _simple_types = (str, int, type(None), bool, float)
+_ATOMIC_TYPES = frozenset(_simple_types)
+_CONTAINER_TYPES = frozenset((dict, list, tuple))
 
 
 def to_primitive(value, convert_instances=False, convert_datetime=True,
@@ -84,57 +92,283 @@ def to_primitive(value, convert_instances=False, convert_datetime=True,
     .. versionchanged:: 1.6
        Dictionary keys are now also encoded.
     """
-    orig_fallback = fallback
-    if fallback is None:
-        fallback = str
-
-    # handle obvious types first - order of basic types determined by running
-    # full tests on nova project, resulting in the following counts:
-    # 572754 <type 'NoneType'>
-    # 460353 <type 'int'>
-    # 379632 <type 'unicode'>
-    # 274610 <type 'str'>
-    # 199918 <type 'dict'>
-    # 114200 <type 'datetime.datetime'>
-    #  51817 <type 'bool'>
-    #  26164 <type 'list'>
-    #   6491 <type 'float'>
-    #    283 <type 'tuple'>
-    #     19 <type 'long'>
-    if isinstance(value, _simple_types):
+    ctx = _Context(convert_instances, convert_datetime, max_depth, encoding,
+                   str if fallback is None else fallback, fallback)
+    return _to_primitive(value, level, ctx)
+
+
+# Settings of a to_primitive() call, passed along with the value to convert
+# and its level to _to_primitive() and the handlers below. orig_fallback is
+# the fallback given to to_primitive(), fallback is str when it is None.
+_Context = collections.namedtuple('_Context', [
+    'convert_instances', 'convert_datetime', 'max_depth', 'encoding',
+    'fallback', 'orig_fallback',
+])
+
+
+def _str_to_primitive(value, level, ctx):
+    return str(value)
+
+
+def _bytes_to_primitive(value, level, ctx):
+    return value.decode(ctx.encoding)
+
+
+def _format_datetime(value):
+    # Like value.strftime(timeutils.PERFECT_TIME_FORMAT), without going
+    # through the format parsing of strftime for every value. Unlike it,
+    # years before 1000 are always padded to 4 digits (0005, not 5).
+    return '%04d-%02d-%02dT%02d:%02d:%02d.%06d' % (
+        value.year, value.month, value.day, value.hour, value.minute,
+        value.second, value.microsecond)
+
+
+def _format_date(value):
+    # Like value.strftime('%Y-%m-%d'), see above.
+    return '%04d-%02d-%02d' % (value.year, value.month, value.day)
+
+
+def _datetime_to_primitive(value, level, ctx):
+    if ctx.convert_datetime:
+        return _format_datetime(value)
+    else:
         return value
 
-    if isinstance(value, bytes):
-        return value.decode(encoding=encoding)
 
+def _date_to_primitive(value, level, ctx):
+    if ctx.convert_datetime:
+        return _format_date(value)
+    else:
+        return value
+
+
+def _xmlrpc_datetime_to_primitive(value, level, ctx):
     # It's not clear why xmlrpclib created their own DateTime type, but
     # for our purposes, make it a datetime type which is explicitly
     # handled
+    value = datetime.datetime(*tuple(value.timetuple())[:6])
+    return _datetime_to_primitive(value, level, ctx)
+
+
+def _is_nasty(value):
+    # NOTE: The outcome of those tests only depends on the type of the value
+    # (isabstract() can only be true when isclass() is), so it is computed
+    # once per type. The cache is simply reset when it gets too big, types
+    # can be created at will (mock does it for each instance). The tests use
+    # isinstance() though, which goes by the __class__ of the value, so the
+    # values overriding it (proxies for example) skip the cache.
+    cls = type(value)
+    if value.__class__ is not cls:
+        nasty = any(test(value) for test in _nasty_type_tests)
+    else:
+        nasty = _nasty_types.get(cls)
+        if nasty is None:
+            nasty = any(test(value) for test in _nasty_type_tests)
+            if len(_nasty_types) >= _NASTY_TYPES_MAX:
+                _nasty_types.clear()
+            _nasty_types[cls] = nasty
+    # NOTE: isgeneratorfunction() unwraps functools.partial objects and also
+    # accepts function-like objects, so it has to be checked on each value.
+    return nasty or (callable(value) and inspect.isgeneratorfunction(value))
+
+
+# Attributes telling how to convert objects which are not handled otherwise,
+# by order of preference, see _conversion_attr().
+_CONVERSION_ATTRS = ('iteritems', 'items', '__iter__')
+# Class attributes which are always found on the instances.
+_METHOD_TYPES = (types.FunctionType, types.MethodDescriptorType,
+                 types.WrapperDescriptorType)
+
+
+@functools.lru_cache(maxsize=2048)
+def _class_conversion_attr(cls):
+    # NOTE: Looked up in the class dicts rather than with hasattr(), which
+    # would also find the attributes of the metaclass (the __iter__ of Enum
+    # classes for example) that instances don't have. Returns the attribute
+    # found and the ones to probe on the values before it, which can only
+    # have others than their class if they have a __dict__ or a __getattr__.
+    if cls.__dictoffset__ or any(
+            '__getattr__' in vars(klass) or '__getattribute__' in vars(klass)
+            for klass in cls.__mro__ if klass is not object):
+        probes = _CONVERSION_ATTRS
+    else:
+        probes = ()
+    for i, name in enumerate(_CONVERSION_ATTRS):
+        for klass in cls.__mro__:
+            if name not in vars(klass):
+                continue
+            attr = vars(klass)[name]
+            # NOTE: Other descriptors (properties for example) may raise
+            # AttributeError, leave those classes to the probes of the value.
+            if (hasattr(type(attr), '__get__') and
+                    not isinstance(attr, _METHOD_TYPES)):
+                return None, _CONVERSION_ATTRS
+            return name, probes[:i]
+    return None, probes
+
+
+@functools.lru_cache(maxsize=2048)
+def _class_iterable(cls):
+    # NOTE: Same rules as iter(), which would raise TypeError otherwise:
+    # classes setting __iter__ to None are not iterable, the others are if
+    # they define __iter__ or __getitem__.
+    for klass in cls.__mro__:
+        if '__iter__' in vars(klass):
+            return vars(klass)['__iter__'] is not None
+    return any('__getitem__' in vars(klass) for klass in cls.__mro__)
+
+
+def _conversion_attr(value):
+    # NOTE: hasattr() is slow when the attribute is missing, so what the
+    # class of the value provides is only looked up once per class. The
+    # value itself is only probed for the attributes coming first which it
+    # could have without its class, set on the instance or from __getattr__.
+    name, probes = _class_conversion_attr(type(value))
+    for probe in probes:
+        if hasattr(value, probe):
+            return probe
+    return name
+
+
+def _all_primitive(iterable):
+    # Same as all(type(x) in _ATOMIC_TYPES for x in iterable), but the loop
+    # runs in C rather than in a Python generator.
+    return _ATOMIC_TYPES.issuperset(map(type, iterable))
+
+
+def _container_to_primitive(value, level, ctx):
+    # NOTE: Nested dicts, lists and tuples do not go any deeper, so they
+    # are walked here with an explicit stack instead of recursing for each
+    # of them. Every container is converted in place of the original object
+    # in its parent, unless that slot was taken by another (colliding) key
+    # in the meantime. Containers nested deeper than the recursion limit
+    # (i.e. cycles) fail like they would when recursing.
+    if level > ctx.max_depth:
+        return None
+    # Local aliases, this loop runs for every item of every container.
+    convert = _to_primitive
+    atomic = _ATOMIC_TYPES
+    containers = _CONTAINER_TYPES
+    all_primitive = _all_primitive
+    max_nesting = sys.getrecursionlimit()
+    root = [value]
+    stack = [(root, 0, value, 0)]
+    push = stack.append
+    pop = stack.pop
+    while stack:
+        parent, key, value, nesting = pop()
+        if nesting > max_nesting:
+            raise RecursionError("maximum nesting depth exceeded while "
+                                 "converting to primitive")
+        try:
+            if isinstance(value, dict):
+                if (type(value) is dict and all_primitive(value) and
+                        all_primitive(value.values())):
+                    # Nothing to convert in there, a copy will do
+                    result = dict(value)
+                else:
+                    result = {}
+                    for k, v in value.items():
+                        if type(k) not in atomic:
+                            k = convert(k, level, ctx)
+                        if type(v) in atomic:
+                            result[k] = v
+                        elif type(v) in containers:
+                            result[k] = v
+                            push((result, k, v, nesting + 1))
+                        else:
+                            result[k] = convert(v, level, ctx)
+            elif type(value) in containers and all_primitive(value):
+                # Nothing to convert in there, a copy will do
+                result = list(value)
+            else:
+                result = []
+                append = result.append
+                for v in value:
+                    if type(v) in atomic:
+                        append(v)
+                    elif type(v) in containers:
+                        push((result, len(result), v, nesting + 1))
+                        append(v)
+                    else:
+                        append(convert(v, level, ctx))
+        except TypeError:
+            # Class objects are tricky since they may define something like
+            # __iter__ defined but it isn't callable as list().
+            result = ctx.fallback(value)
+        if parent[key] is value:
+            parent[key] = result
+    return root[0]
+
+
+# handle obvious types first - order of basic types determined by running
+# full tests on nova project, resulting in the following counts:
+# 572754 <type 'NoneType'>
+# 460353 <type 'int'>
+# 379632 <type 'unicode'>
+# 274610 <type 'str'>
+# 199918 <type 'dict'>
+# 114200 <type 'datetime.datetime'>
+#  51817 <type 'bool'>
+#  26164 <type 'list'>
+#   6491 <type 'float'>
+#    283 <type 'tuple'>
+#     19 <type 'long'>
+# Exact types only, subclasses are handled by the isinstance() checks of
+# _to_primitive(). The _ATOMIC_TYPES are returned as is before looking
+# into this table.
+_PRIMITIVE_DISPATCH = {
+    dict: _container_to_primitive,
+    datetime.datetime: _datetime_to_primitive,
+    list: _container_to_primitive,
+    tuple: _container_to_primitive,
+    bytes: _bytes_to_primitive,
+    datetime.date: _date_to_primitive,
+    xmlrpclib.DateTime: _xmlrpc_datetime_to_primitive,
+    uuid.UUID: _str_to_primitive,
+}
+if netaddr:
+    _PRIMITIVE_DISPATCH[netaddr.IPAddress] = _str_to_primitive
+    _PRIMITIVE_DISPATCH[netaddr.IPNetwork] = _str_to_primitive
+if ipaddress:
+    _PRIMITIVE_DISPATCH[ipaddress.IPv4Address] = _str_to_primitive
+    _PRIMITIVE_DISPATCH[ipaddress.IPv6Address] = _str_to_primitive
+
+
+def _to_primitive(value, level, ctx):
+    if type(value) in _ATOMIC_TYPES:
+        return value
+
+    handler = _PRIMITIVE_DISPATCH.get(type(value))
+    if handler is not None:
+        return handler(value, level, ctx)
+
+    if isinstance(value, _simple_types):
+        return value
+
+    # Subclasses of the types handled above
+    if isinstance(value, bytes):
+        return _bytes_to_primitive(value, level, ctx)
+
     if isinstance(value, xmlrpclib.DateTime):
-        value = datetime.datetime(*tuple(value.timetuple())[:6])
+        return _xmlrpc_datetime_to_primitive(value, level, ctx)
 
     if isinstance(value, datetime.datetime):
-        if convert_datetime:
-            return value.strftime(timeutils.PERFECT_TIME_FORMAT)
-        else:
-            return value
+        return _datetime_to_primitive(value, level, ctx)
 
     if isinstance(value, datetime.date):
-        if convert_datetime:
-            return value.strftime(_ISO8601_DATE_FORMAT)
-        else:
-            return value
+        return _date_to_primitive(value, level, ctx)
 
     if isinstance(value, uuid.UUID):
-        return str(value)
+        return _str_to_primitive(value, level, ctx)
 
     if netaddr and isinstance(value, (netaddr.IPAddress, netaddr.IPNetwork)):
-        return str(value)
+        return _str_to_primitive(value, level, ctx)
 
     if ipaddress and isinstance(value,
                                 (ipaddress.IPv4Address,
                                  ipaddress.IPv6Address)):
-        return str(value)
+        return _str_to_primitive(value, level, ctx)
 
     # For exceptions, return the 'repr' of the exception object
     if isinstance(value, Exception):
@@ -143,52 +377,54 @@ def to_primitive(value, convert_instances=False, convert_datetime=True,
     # value of itertools.count doesn't get caught by nasty_type_tests
     # and results in infinite loop when list(value) is called.
     if type(value) is itertools.count:
-        return fallback(value)
+        return ctx.fallback(value)
 
-    if any(test(value) for test in _nasty_type_tests):
-        return fallback(value)
+    if _is_nasty(value):
+        return ctx.fallback(value)
 
-    if level > max_depth:
+    if level > ctx.max_depth:
         return None
 
     # The try block may not be necessary after the class check above,
     # but just in case ...
     try:
-        recursive = functools.partial(to_primitive,
-                                      convert_instances=convert_instances,
-                                      convert_datetime=convert_datetime,
-                                      level=level,
-                                      max_depth=max_depth,
-                                      encoding=encoding,
-                                      fallback=orig_fallback)
+        attr = _conversion_attr(value)
         if isinstance(value, dict):
-            return {recursive(k): recursive(v)
-                    for k, v in value.items()}
-        elif hasattr(value, 'iteritems'):
-            return recursive(dict(value.iteritems()), level=level + 1)
+            return _container_to_primitive(value, level, ctx)
+        elif attr == 'iteritems':
+            return _to_primitive(dict(value.iteritems()), level + 1, ctx)
         # Python 3 does not have iteritems
-        elif hasattr(value, 'items'):
-            return recursive(dict(value.items()), level=level + 1)
-        elif hasattr(value, '__iter__') and not isinstance(value, io.IOBase):
-            return list(map(recursive, value))
-        elif convert_instances and hasattr(value, '__dict__'):
+        elif attr == 'items':
+            return _to_primitive(dict(value.items()), level + 1, ctx)
+        elif attr == '__iter__' and not isinstance(value, io.IOBase):
+            if not _class_iterable(type(value)):
+                # Falls back like the TypeError below, without raising it
+                # each time.
+                return ctx.fallback(value)
+            return _container_to_primitive(value, level, ctx)
+        elif ctx.convert_instances and hasattr(value, '__dict__'):
             # Likely an instance of something. Watch for cycles.
             # Ignore class member vars.
-            return recursive(value.__dict__, level=level + 1)
+            return _to_primitive(value.__dict__, level + 1, ctx)
     except TypeError:
         # Class objects are tricky since they may define something like
         # __iter__ defined but it isn't callable as list().
-        return fallback(value)
+        return ctx.fallback(value)
 
-    if orig_fallback is None:
+    if ctx.orig_fallback is None:
         raise ValueError("Cannot convert {!r} to primitive".format(value))
 
-    return orig_fallback(value)
+    return ctx.orig_fallback(value)
 
 
 JSONEncoder = json.JSONEncoder
 JSONDecoder = json.JSONDecoder
 
+# NOTE: json.dumps() only reuses its module level encoder when called
+# without any parameter, which is never the case here since ``default`` is
+# always set. Keep our own for the common case.
+_default_encoder = JSONEncoder(default=to_primitive)
+
 
 def dumps(obj, default=to_primitive, **kwargs):
     """Serialize ``obj`` to a JSON formatted ``str``.
@@ -203,6 +439,8 @@ def dumps(obj, default=to_primitive, **kwargs):
     Use dump_as_bytes() to ensure that the result type is ``bytes`` on Python 2
     and Python 3.
     """
+    if default is to_primitive and not kwargs:
+        return _default_encoder.encode(obj)
     return json.dumps(obj, default=default, **kwargs)
 
 
@@ -237,8 +475,49 @@ def dump(obj, fp, *args, **kwargs):
     .. versionchanged:: 1.3
        The *default* parameter now uses :func:`to_primitive` by default.
     """
-    default = kwargs.get('default', to_primitive)
-    return json.dump(obj, fp, default=default, *args, **kwargs)
+    # NOTE: json.dump() writes each chunk produced by the encoder to fp,
+    # serializing to a string first and writing it at once is much faster.
+    default = kwargs.pop('default', to_primitive)
+    fp.write(dumps(obj, default, *args, **kwargs))
+
+
+# Maps every digit to 0 and anything else to a space, see _has_long_number().
+_DIGITS_TO_ZERO = bytes(0x30 if 0x30 <= c <= 0x39 else 0x20
+                        for c in range(256))
+_LONG_NUMBER = b'0' * 19
+
+
+def _has_long_number(s):
+    # NOTE: Looks for runs of digits long enough to be an integer that may
+    # not fit in 64 bits. A translate() then substring search is several
+    # times faster than a regular expression.
+    if isinstance(s, str):
+        s = s.encode('utf-8', 'surrogatepass')
+    elif isinstance(s, memoryview):
+        s = s.tobytes()
+    return _LONG_NUMBER in s.translate(_DIGITS_TO_ZERO)
+
+
+def _has_bom(s):
+    # NOTE: simdjson skips a leading byte order mark, which the json module
+    # refuses.
+    if isinstance(s, str):
+        return s[:1] == '\ufeff'
+    return s[:3] == codecs.BOM_UTF8
+
+
+# Per thread simdjson.Parser, see _simdjson_loads().
+_simdjson_parsers = threading.local()
+
+
+def _simdjson_loads(s):
+    # NOTE: A parser reuses the buffers it allocated for earlier documents,
+    # but can only parse one document at a time.
+    try:
+        parser = _simdjson_parsers.parser
+    except AttributeError:
+        parser = _simdjson_parsers.parser = simdjson.Parser()
+    return parser.parse(s, True)
 
 
 def loads(s, encoding='utf-8', **kwargs):
@@ -249,7 +528,36 @@ def loads(s, encoding='utf-8', **kwargs):
     :param kwargs: extra named parameters, please see documentation \
     of `json.loads <https://docs.python.org/2/library/json.html#basic-usage>`_
     :returns: python object
+
+    When ``orjson`` (or else ``pysimdjson``) is available and no extra named
+    parameters are given, it is used to decode ``s``.
     """
+    if not kwargs and (isinstance(s, str) or (
+            encoding == 'utf-8' and
+            isinstance(s, (bytes, bytearray, memoryview)))):
+        # NOTE: orjson and simdjson are stricter than the json module (no
+        # NaN or Infinity, 64-bit integers only, no lone surrogates...), so
+        # leave anything they refuse to the json module which has the final
+        # word. orjson does not refuse integers wider than 64 bits but turns
+        # them into floats, so documents with such long numbers (or digit
+        # runs in strings, which is harmless) go to the json module as well.
+        if orjson is not None:
+            if not _has_long_number(s):
+                try:
+                    return orjson.loads(s)
+                except orjson.JSONDecodeError:
+                    pass
+        elif simdjson is not None and not _has_bom(s):
+            try:
+                return _simdjson_loads(s)
+            except (ValueError, RuntimeError, TypeError):
+                pass
+    if isinstance(s, str):
+        return json.loads(s, **kwargs)
+    if encoding == 'utf-8' and isinstance(s, (bytes, bytearray)):
+        # NOTE: Not json.loads(s), which also detects UTF-16 and UTF-32 and
+        # lets lone surrogates through rather than refusing them.
+        return json.loads(s.decode('utf-8'), **kwargs)
     return json.loads(encodeutils.safe_decode(s, encoding), **kwargs)
 
 
@@ -262,7 +570,7 @@ def load(fp, encoding='utf-8', **kwargs):
     of `json.loads <https://docs.python.org/2/library/json.html#basic-usage>`_
     :returns: python object
     """
-    return json.load(codecs.getreader(encoding)(fp), **kwargs)
+    return loads(fp.read(), encoding=encoding, **kwargs)
 
 
 try:
@@ -29,8 +29,8 @@ This module provides a few things:
 
 
 import datetime
-import functools
 import itertools
+import threading
 import uuid
 from xmlrpc import client as xmlrpclib
 import zoneinfo
@@ -41,6 +41,11 @@ from oslo_utils import importutils
 
 netaddr = importutils.try_import("netaddr")
 
+# Largest packed size (in bytes) after which a packer is not reused.
+_PACKER_KEEP_MAX = 1024 * 1024
+# Number of types after which HandlerRegistry.match() resets its index.
+_TYPE_INDEX_MAX = 1024
+
 
 class Interval:
     """Small and/or simple immutable integer/float interval class.
@@ -65,7 +70,7 @@ class Interval:
         return self._max_value
 
     def __contains__(self, value):
-        return value >= self.min_value and value <= self.max_value
+        return self._min_value <= value <= self._max_value
 
     def __repr__(self):
         return 'Interval({}, {})'.format(self._min_value, self._max_value)
@@ -122,7 +127,22 @@ class HandlerRegistry:
     def __init__(self):
         self._handlers = {}
         self._num_handlers = 0
+        self._type_index = {}
+        self._reindex()
         self.frozen = False
+        # Per thread msgpack.Packer, see _pack().
+        self._packers = threading.local()
+
+    def __getstate__(self):
+        # NOTE: The per thread packers can't be copied (or pickled), copies
+        # of the registry start without any.
+        state = self.__dict__.copy()
+        del state['_packers']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._packers = threading.local()
 
     def __iter__(self):
         """Iterates over **all** registered handlers."""
@@ -159,6 +179,31 @@ class HandlerRegistry:
         else:
             self._handlers[ident] = [handler]
             self._num_handlers += 1
+        self._reindex()
+
+    def _reindex(self):
+        """Rebuild the lookup structures used by get() and match()."""
+        # Handler per identity (the first one if there are many, as this is
+        # how we override built-in extensions), None when there is none.
+        # It is followed by as many None as there are negative extension
+        # codes (-1 to -128, reserved by msgpack), so that any code read by
+        # the unpacker can index it directly.
+        self._by_ident = tuple(
+            self._handlers[ident][0] if ident in self._handlers else None
+            for ident in range(self.max_value + 1)) + (None,) * 128
+        # Handled types and their handler, in the order to match them.
+        self._match_types = tuple((h.handles, h) for h in self)
+        # Start with the handled types themselves, so that the common case
+        # of serializing exactly those never needs the scan in match().
+        self._type_index.clear()
+        for handles, _h in self._match_types:
+            for cls in handles:
+                if cls not in self._type_index:
+                    self._type_index[cls] = self._scan(cls)
+
+    def freeze(self):
+        """Make the registry read-only (further registrations fail)."""
+        self.frozen = True
 
     def __len__(self):
         """Return how many extension handlers are registered."""
@@ -179,43 +224,98 @@ class HandlerRegistry:
                 cloned_handlers.append(h)
             c._handlers[ident] = cloned_handlers
             c._num_handlers += len(cloned_handlers)
+        c._reindex()
         if not unfreeze and self.frozen:
-            c.frozen = True
+            c.freeze()
         return c
 
     def get(self, identity):
         """Get the handler for the given numeric identity (or none)."""
-        maybe_handlers = self._handlers.get(identity)
-        if maybe_handlers:
-            # Prefer the first (if there are many) as this is how we
-            # override built-in extensions (for those that wish to do this).
-            return maybe_handlers[0]
-        else:
-            return None
+        try:
+            if identity >= 0:
+                return self._by_ident[identity]
+        except (IndexError, TypeError):
+            pass
+        return None
 
     def match(self, obj):
         """Match the registries handlers to the given object (or none)."""
-        for possible_handlers in self._handlers.values():
-            for h in possible_handlers:
-                if isinstance(obj, h.handles):
+        # NOTE: Other types are added to the index as they get matched, the
+        # ones that no handler matches too (as None). The index is simply
+        # rebuilt when it gets too big, types can be created at will.
+        cls = type(obj)
+        if obj.__class__ is not cls:
+            # NOTE: Objects claiming another class (proxies for example) are
+            # matched with isinstance(), which believes them, and not cached.
+            for handles, h in self._match_types:
+                if isinstance(obj, handles):
                     return h
+            return None
+        try:
+            return self._type_index[cls]
+        except KeyError:
+            pass
+        if len(self._type_index) >= _TYPE_INDEX_MAX:
+            self._reindex()
+        h = self._type_index[cls] = self._scan(cls)
+        return h
+
+    def serialize(self, obj):
+        """Serialize ``obj`` into a msgpack extension type (using a handler).
+
+        This is the ``default`` hook given to the msgpack packer.
+        """
+        handler = self.match(obj)
+        if handler is None:
+            raise ValueError("No serialization handler registered"
+                             " for type '%s'" % (type(obj).__name__))
+        return msgpack.ExtType(handler.identity, handler.serialize(obj))
+
+    def unserialize(self, code, data):
+        """Deserialize a msgpack extension type (using a handler).
+
+        This is the ``ext_hook`` given to the msgpack unpacker; extension
+        types without a handler are returned as is.
+        """
+        handler = self._by_ident[code]
+        if handler is None:
+            return msgpack.ExtType(code, data)
+        else:
+            return handler.deserialize(data)
+
+    def _scan(self, cls):
+        # The first handler (in registration order) handling the type or
+        # one of its bases wins, like datetime over date.
+        for handles, h in self._match_types:
+            if issubclass(cls, handles):
+                return h
         return None
 
 
 class UUIDHandler:
+    __slots__ = ()
     identity = 0
     handles = (uuid.UUID,)
 
     @staticmethod
     def serialize(obj):
-        return str(obj.hex).encode('ascii')
+        # NOTE: deserialize() also accepts the twice smaller obj.bytes form,
+        # which can be produced here once no release unable to read it
+        # remains in use.
+        # Same as obj.hex.encode('ascii'), without the str in between.
+        return b'%032x' % obj.int
 
     @staticmethod
     def deserialize(data):
+        if len(data) == 16:
+            return uuid.UUID(bytes=bytes(data))
+        if len(data) == 32:
+            return uuid.UUID(int=int(data, 16))
         return uuid.UUID(hex=str(data, encoding='ascii'))
 
 
 class DateTimeHandler:
+    __slots__ = ('_registry',)
     identity = 1
     handles = (datetime.datetime,)
 
@@ -237,10 +337,12 @@ class DateTimeHandler:
         }
         if dt.tzinfo:
             dct['tz'] = str(dt.tzinfo)
-        return dumps(dct, registry=self._registry)
+        # NOTE: There is nothing in there needing an extension, so skip the
+        # registry when packing (and unpacking) it.
+        return msgpack.packb(dct, use_bin_type=True)
 
     def deserialize(self, blob):
-        dct = loads(blob, registry=self._registry)
+        dct = msgpack.unpackb(blob, raw=False)
 
         if b"day" in dct:
             # NOTE(sileht): oslo.serialization <= 2.4.1 was
@@ -268,6 +370,7 @@ class DateTimeHandler:
 
 
 class CountHandler:
+    __slots__ = ()
     identity = 2
     handles = (itertools.count,)
 
@@ -275,17 +378,11 @@ class CountHandler:
     def serialize(obj):
         # FIXME(harlowja): figure out a better way to avoid hacking into
         # the string representation of count to get at the right numbers...
-        obj = str(obj)
-        start = obj.find("(") + 1
-        end = obj.rfind(")")
-        pieces = obj[start:end].split(",")
-        if len(pieces) == 1:
-            start = int(pieces[0])
-            step = 1
-        else:
-            start = int(pieces[0])
-            step = int(pieces[1])
-        return msgpack.packb([start, step])
+        # NOTE: count.__reduce__() would give them, but pickle support of
+        # itertools is deprecated since python 3.12 (and gone in 3.14).
+        obj = repr(obj)
+        start, _sep, step = obj[obj.index("(") + 1:-1].partition(",")
+        return msgpack.packb([int(start), int(step) if step else 1])
 
     @staticmethod
     def deserialize(data):
@@ -296,6 +393,7 @@ class CountHandler:
 
 if netaddr is not None:
     class NetAddrIPHandler:
+        __slots__ = ()
         identity = 3
         handles = (netaddr.IPAddress,)
 
@@ -311,6 +409,7 @@ else:
 
 
 class SetHandler:
+    __slots__ = ('_registry',)
     identity = 4
     handles = (set,)
 
@@ -321,18 +420,22 @@ class SetHandler:
         return type(self)(registry)
 
     def serialize(self, obj):
-        return dumps(list(obj), registry=self._registry)
+        return _pack(list(obj), self._registry)
 
     def deserialize(self, data):
-        return self.handles[0](loads(data, registry=self._registry))
+        registry = self._registry
+        return self.handles[0](msgpack.unpackb(
+            data, ext_hook=registry.unserialize, raw=False))
 
 
 class FrozenSetHandler(SetHandler):
+    __slots__ = ()
     identity = 5
     handles = (frozenset,)
 
 
 class XMLRPCDateTimeHandler:
+    __slots__ = ('_handler',)
     handles = (xmlrpclib.DateTime,)
     identity = 6
 
@@ -343,7 +446,15 @@ class XMLRPCDateTimeHandler:
         return type(self)(registry)
 
     def serialize(self, obj):
-        dt = datetime.datetime(*tuple(obj.timetuple())[:6])
+        v = obj.value
+        if len(v) == 17 and v[8] == 'T':
+            # Read the fields of the '%Y%m%dT%H:%M:%S' value directly,
+            # obj.timetuple() goes through time.strptime().
+            dt = datetime.datetime(int(v[0:4]), int(v[4:6]), int(v[6:8]),
+                                   int(v[9:11]), int(v[12:14]),
+                                   int(v[15:17]))
+        else:
+            dt = datetime.datetime(*tuple(obj.timetuple())[:6])
         return self._handler.serialize(dt)
 
     def deserialize(self, blob):
@@ -352,6 +463,7 @@ class XMLRPCDateTimeHandler:
 
 
 class DateHandler:
+    __slots__ = ('_registry',)
     identity = 7
     handles = (datetime.date,)
 
@@ -367,10 +479,10 @@ class DateHandler:
             'month': d.month,
             'day': d.day,
         }
-        return dumps(dct, registry=self._registry)
+        return msgpack.packb(dct, use_bin_type=True)
 
     def deserialize(self, blob):
-        dct = loads(blob, registry=self._registry)
+        dct = msgpack.unpackb(blob, raw=False)
         if b"day" in dct:
             # NOTE(sileht): see DateTimeHandler.deserialize()
             dct = {k.decode("ascii"): v for k, v in dct.items()}
@@ -380,20 +492,31 @@ class DateHandler:
                              day=dct['day'])
 
 
-def _serializer(registry, obj):
-    handler = registry.match(obj)
-    if handler is None:
-        raise ValueError("No serialization handler registered"
-                         " for type '%s'" % (type(obj).__name__))
-    return msgpack.ExtType(handler.identity, handler.serialize(obj))
-
-
-def _unserializer(registry, code, data):
-    handler = registry.get(code)
-    if not handler:
-        return msgpack.ExtType(code, data)
-    else:
-        return handler.deserialize(data)
+def _pack(obj, registry, many=False):
+    # NOTE: Reuse the msgpack.Packer of this thread for the registry rather
+    # than setting up a new one each time. Handlers may pack again while
+    # the packer is in use (the items of a set for example), so take it out
+    # until done so that those calls get their own.
+    packers = registry._packers
+    packer = getattr(packers, 'packer', None)
+    if packer is None:
+        packer = msgpack.Packer(default=registry.serialize,
+                                use_bin_type=True)
+    packers.packer = None
+    size = 0
+    try:
+        if many:
+            chunks = [packer.pack(o) for o in obj]
+            size = max(map(len, chunks), default=0)
+            return b''.join(chunks)
+        result = packer.pack(obj)
+        size = len(result)
+        return result
+    finally:
+        # NOTE: The packer keeps its buffer at the largest size it has
+        # packed, so do not hold on to one that has packed a large payload.
+        if size <= _PACKER_KEEP_MAX:
+            packers.packer = packer
 
 
 def _create_default_registry():
@@ -407,7 +530,7 @@ def _create_default_registry():
     if netaddr is not None:
         registry.register(NetAddrIPHandler(), reserved=True)
     registry.register(XMLRPCDateTimeHandler(registry), reserved=True)
-    registry.frozen = True
+    registry.freeze()
     return registry
 
 
@@ -440,8 +563,8 @@ def load(fp, registry=None):
     # NOTE(harlowja): the reason we can't use the more native msgpack functions
     # here is that the unpack() function (oddly) doesn't seem to take a
     # 'ext_hook' parameter..
-    ext_hook = functools.partial(_unserializer, registry)
-    return msgpack.Unpacker(fp, ext_hook=ext_hook, raw=False).unpack()
+    return msgpack.Unpacker(fp, ext_hook=registry.unserialize,
+                            raw=False).unpack()
 
 
 def dump(obj, fp, registry=None):
@@ -452,9 +575,7 @@ def dump(obj, fp, registry=None):
     """
     if registry is None:
         registry = default_registry
-    return msgpack.pack(obj, fp,
-                        default=functools.partial(_serializer, registry),
-                        use_bin_type=True)
+    fp.write(_pack(obj, registry))
 
 
 def dumps(obj, registry=None):
@@ -465,9 +586,18 @@ def dumps(obj, registry=None):
     """
     if registry is None:
         registry = default_registry
-    return msgpack.packb(obj,
-                         default=functools.partial(_serializer, registry),
-                         use_bin_type=True)
+    return _pack(obj, registry)
+
+
+def dumps_many(objs, registry=None):
+    """Serialize each of ``objs`` in turn to a single messagepack ``str``.
+
+    The result is the concatenation of what :func:`.dumps` gives for each
+    object, which a :class:`msgpack.Unpacker` reads back one by one.
+    """
+    if registry is None:
+        registry = default_registry
+    return _pack(objs, registry, many=True)
 
 
 def loads(s, registry=None):
@@ -478,5 +608,4 @@ def loads(s, registry=None):
     """
     if registry is None:
         registry = default_registry
-    ext_hook = functools.partial(_unserializer, registry)
-    return msgpack.unpackb(s, ext_hook=ext_hook, raw=False)
+    return msgpack.unpackb(s, ext_hook=registry.unserialize, raw=False)
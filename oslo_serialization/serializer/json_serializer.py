@@ -25,7 +25,7 @@ class JSONSerializer(BaseSerializer):
         self._encoding = encoding
 
     def dump(self, obj, fp):
-        return jsonutils.dump(obj, fp)
+        return jsonutils.dump(obj, fp, default=self._default)
 
     def dump_as_bytes(self, obj):
         return jsonutils.dump_as_bytes(obj, default=self._default,
@@ -13,15 +13,54 @@
 #    under the License.
 
 
+import functools
+
+from oslo_utils import importutils
+
 from oslo_serialization import msgpackutils
 from oslo_serialization.serializer.base_serializer import BaseSerializer
 
+msgspec = importutils.try_import('msgspec')
+
+
+def _ext_hook(registry, code, data):
+    return registry.unserialize(code, bytes(data))
+
 
 class MessagePackSerializer(BaseSerializer):
-    """MessagePack serializer based on the msgpackutils module."""
+    """MessagePack serializer based on the msgpackutils module.
+
+    With ``fast=True`` (and msgspec installed), byte strings are decoded
+    with msgspec instead of msgpack, the registry handlers still decoding
+    the extension types. Encoding and reading from files always go through
+    msgpackutils, so that every type the registry handles round-trips the
+    same in both modes.
+    """
 
-    def __init__(self, registry=None):
+    def __init__(self, registry=None, fast=False):
         self._registry = registry
+        self._fast = fast
+        self._decoder = self._make_decoder()
+
+    def _make_decoder(self):
+        if not self._fast or msgspec is None:
+            return None
+        registry = self._registry
+        if registry is None:
+            registry = msgpackutils.default_registry
+        return msgspec.msgpack.Decoder(
+            ext_hook=functools.partial(_ext_hook, registry))
+
+    def __getstate__(self):
+        # NOTE: msgspec decoders can't be copied (or pickled), copies of the
+        # serializer make their own.
+        state = self.__dict__.copy()
+        del state['_decoder']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._decoder = self._make_decoder()
 
     def dump(self, obj, fp):
         return msgpackutils.dump(obj, fp, registry=self._registry)
@@ -29,8 +68,18 @@ class MessagePackSerializer(BaseSerializer):
     def dump_as_bytes(self, obj):
         return msgpackutils.dumps(obj, registry=self._registry)
 
+    def dump_many(self, objs):
+        """Serialize each of ``objs`` in turn to a single byte string.
+
+        :param objs: iterable of python objects to be serialized
+        :returns: byte string
+        """
+        return msgpackutils.dumps_many(objs, registry=self._registry)
+
     def load(self, fp):
         return msgpackutils.load(fp, registry=self._registry)
 
     def load_from_bytes(self, s):
+        if self._decoder is not None:
+            return self._decoder.decode(s)
         return msgpackutils.loads(s, registry=self._registry)
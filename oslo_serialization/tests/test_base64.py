@@ -19,31 +19,45 @@ from oslotest import base as test_base
 
 class Base64Tests(test_base.BaseTestCase):
 
+    # (text or bytes, encoding (None for the default), base64 encoded)
+    encode_cases = [
+        (b'text', None, b'dGV4dA=='),
+        ('text', None, b'dGV4dA=='),
+        ('e:\xe9', None, b'ZTrDqQ=='),
+        ('e:\xe9', 'latin1', b'ZTrp'),
+    ]
+
+    # (base64 encoded, encoding (None for the default), text)
+    decode_cases = [
+        (b'dGV4dA==', None, 'text'),
+        ('dGV4dA==', None, 'text'),
+        ('ZTrDqQ==', None, 'e:\xe9'),
+        ('ZTrp', 'latin1', 'e:\xe9'),
+    ]
+
+    @staticmethod
+    def _kwargs(encoding):
+        return {} if encoding is None else {'encoding': encoding}
+
     def test_encode_as_bytes(self):
-        self.assertEqual(b'dGV4dA==',
-                         base64.encode_as_bytes(b'text'))
-        self.assertEqual(b'dGV4dA==',
-                         base64.encode_as_bytes('text'))
-        self.assertEqual(b'ZTrDqQ==',
-                         base64.encode_as_bytes('e:\xe9'))
-        self.assertEqual(b'ZTrp',
-                         base64.encode_as_bytes('e:\xe9', encoding='latin1'))
+        for arg, encoding, expected in self.encode_cases:
+            with self.subTest(arg=arg, encoding=encoding):
+                self.assertEqual(expected,
+                                 base64.encode_as_bytes(
+                                     arg, **self._kwargs(encoding)))
 
     def test_encode_as_text(self):
-        self.assertEqual('dGV4dA==',
-                         base64.encode_as_text(b'text'))
-        self.assertEqual('dGV4dA==',
-                         base64.encode_as_text('text'))
-        self.assertEqual('ZTrDqQ==',
-                         base64.encode_as_text('e:\xe9'))
-        self.assertEqual('ZTrp',
-                         base64.encode_as_text('e:\xe9', encoding='latin1'))
+        for arg, encoding, expected in self.encode_cases:
+            with self.subTest(arg=arg, encoding=encoding):
+                self.assertEqual(expected.decode('ascii'),
+                                 base64.encode_as_text(
+                                     arg, **self._kwargs(encoding)))
 
     def test_decode_as_bytes(self):
-        self.assertEqual(b'text',
-                         base64.decode_as_bytes(b'dGV4dA=='))
-        self.assertEqual(b'text',
-                         base64.decode_as_bytes('dGV4dA=='))
+        for arg, encoding, expected in self.decode_cases:
+            with self.subTest(arg=arg):
+                self.assertEqual(expected.encode(encoding or 'utf-8'),
+                                 base64.decode_as_bytes(arg))
 
     def test_decode_as_bytes__error(self):
         self.assertRaises(TypeError,
@@ -51,11 +65,8 @@ class Base64Tests(test_base.BaseTestCase):
                           'hello world')
 
     def test_decode_as_text(self):
-        self.assertEqual('text',
-                         base64.decode_as_text(b'dGV4dA=='))
-        self.assertEqual('text',
-                         base64.decode_as_text('dGV4dA=='))
-        self.assertEqual('e:\xe9',
-                         base64.decode_as_text('ZTrDqQ=='))
-        self.assertEqual('e:\xe9',
-                         base64.decode_as_text('ZTrp', encoding='latin1'))
+        for arg, encoding, expected in self.decode_cases:
+            with self.subTest(arg=arg, encoding=encoding):
+                self.assertEqual(expected,
+                                 base64.decode_as_text(
+                                     arg, **self._kwargs(encoding)))
@@ -13,76 +13,211 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import codecs
 import collections
 import collections.abc
 import datetime
+import enum
 import functools
 import io
 import ipaddress
 import itertools
-import json
+import math
 from unittest import mock
 from xmlrpc import client as xmlrpclib
 
 import netaddr
 from oslo_i18n import fixture
+from oslo_utils import importutils
 from oslotest import base as test_base
+import testscenarios
 
 from oslo_serialization import jsonutils
+from oslo_serialization.serializer import json_serializer
+
+orjson = importutils.try_import('orjson')
+simdjson = importutils.try_import('simdjson')
+
+
+_Foo = collections.namedtuple("foo", "bar baz")
+_CONVERT_REPR = functools.partial(jsonutils.to_primitive, fallback=repr)
 
 
 class ReprObject:
+    __slots__ = ()
+
     def __repr__(self):
         return 'repr'
 
 
-class JSONUtilsTestMixin:
+_REPR_OBJ = ReprObject()
+
+
+class IterClass:
+    __slots__ = ('data',)
+
+    def __init__(self):
+        self.data = [1, 2, 3, 4, 5]
+
+    def __iter__(self):
+        yield from self.data
+
+
+class IterItemsClass:
+    __slots__ = ('data',)
+
+    def __init__(self):
+        self.data = dict(a=1, b=2, c=3)
+
+    def iteritems(self):
+        return self.data.items()
+
+
+class ItemsClass:
+    __slots__ = ('data',)
+
+    def __init__(self):
+        self.data = dict(a=1, b=2, c=3)
+
+    def items(self):
+        return self.data.items()
+
+
+class InstanceItemsClass:
+    # No __slots__, items() must be set on the instance, not on its class
+    def __init__(self):
+        self.items = dict(a=1, b=2, c=3).items
+
+
+class ItemsIterItemsClass:
+    __slots__ = ()
+
+    def items(self):
+        return {'items': 'items'}
+
+    def iteritems(self):
+        return {'iteritems': 'iteritems'}
+
+
+class MappingClass(collections.abc.Mapping):
+    __slots__ = ('data',)
+
+    def __init__(self):
+        self.data = dict(a=1, b=2, c=3)
+
+    def __getitem__(self, val):
+        return self.data[val]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+
+class MysteryClass:
+    # No __slots__, to_primitive() converts the instance __dict__
+    a = 10
+
+    def __init__(self):
+        self.b = 1
+
+
+class LevelsGenerator:
+    __slots__ = ('_levels',)
+
+    def __init__(self, levels):
+        self._levels = levels
 
-    json_impl = None
+    def iteritems(self):
+        if self._levels == 0:
+            return ()
+        return ((0, LevelsGenerator(self._levels - 1)),)
+
+
+def _expected(levels):
+    """Return what to_primitive() gives for ``levels`` nested levels."""
+    d = None
+    for _ in range(levels):
+        d = {0: d}
+    return d
+
+
+class _ListWriter:
+    __slots__ = ('chunks',)
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, s):
+        self.chunks.append(s)
+
+
+def _json_scenarios():
+    scenarios = [('json', {})]
+    if orjson is not None:
+        scenarios.append(('orjson', {'orjson_impl': orjson}))
+    if simdjson is not None:
+        scenarios.append(('simdjson', {'simdjson_impl': simdjson}))
+    return scenarios
+
+
+class JSONUtilsTestCase(testscenarios.WithScenarios, test_base.BaseTestCase):
+
+    # One scenario per decoding backend available, the json module is
+    # always used for encoding (and for what the others refuse).
+    scenarios = _json_scenarios()
+
+    orjson_impl = None
+    simdjson_impl = None
 
     def setUp(self):
         super().setUp()
-        self.json_patcher = mock.patch.multiple(
-            jsonutils, json=self.json_impl,
-        )
-        self.json_impl_mock = self.json_patcher.start()
+        self._saved_impls = (jsonutils.orjson, jsonutils.simdjson)
+        jsonutils.orjson = self.orjson_impl
+        jsonutils.simdjson = self.simdjson_impl
 
     def tearDown(self):
-        self.json_patcher.stop()
+        jsonutils.orjson, jsonutils.simdjson = self._saved_impls
         super().tearDown()
 
     def test_dumps(self):
         self.assertEqual('{"a": "b"}', jsonutils.dumps({'a': 'b'}))
 
     def test_dumps_default(self):
-        args = [ReprObject()]
-        convert = functools.partial(jsonutils.to_primitive, fallback=repr)
-        self.assertEqual('["repr"]', jsonutils.dumps(args, default=convert))
+        self.assertEqual('["repr"]', jsonutils.dumps([_REPR_OBJ],
+                                                     default=_CONVERT_REPR))
 
     def test_dump_as_bytes(self):
         self.assertEqual(b'{"a": "b"}', jsonutils.dump_as_bytes({'a': 'b'}))
 
     def test_dumps_namedtuple(self):
-        n = collections.namedtuple("foo", "bar baz")(1, 2)
+        n = _Foo(1, 2)
         self.assertEqual('[1, 2]', jsonutils.dumps(n))
 
     def test_dump(self):
         expected = '{"a": "b"}'
         json_dict = {'a': 'b'}
 
-        fp = io.StringIO()
-        jsonutils.dump(json_dict, fp)
+        w = _ListWriter()
+        jsonutils.dump(json_dict, w)
 
-        self.assertEqual(expected, fp.getvalue())
+        self.assertEqual(expected, ''.join(w.chunks))
+
+    def test_dump_default(self):
+        w = _ListWriter()
+        jsonutils.dump([_REPR_OBJ], w, default=_CONVERT_REPR)
+
+        self.assertEqual('["repr"]', ''.join(w.chunks))
 
     def test_dump_namedtuple(self):
         expected = '[1, 2]'
-        json_dict = collections.namedtuple("foo", "bar baz")(1, 2)
+        json_dict = _Foo(1, 2)
 
-        fp = io.StringIO()
-        jsonutils.dump(json_dict, fp)
+        w = _ListWriter()
+        jsonutils.dump(json_dict, w)
 
-        self.assertEqual(expected, fp.getvalue())
+        self.assertEqual(expected, ''.join(w.chunks))
 
     def test_loads(self):
         self.assertEqual({'a': 'b'}, jsonutils.loads('{"a": "b"}'))
@@ -98,11 +233,47 @@ class JSONUtilsTestMixin:
         i18n_str = i18n_str_unicode.encode('utf-8')
         self.assertIsInstance(jsonutils.loads(i18n_str), str)
 
+    def test_loads_bytes_no_safe_decode(self):
+        with mock.patch.object(jsonutils.encodeutils, 'safe_decode') as dec:
+            self.assertEqual('foo', jsonutils.loads(b'"foo"'))
+            self.assertEqual({'a': 1},
+                             jsonutils.loads(bytearray(b'{"a": 1}')))
+        dec.assert_not_called()
+
+    def test_loads_bytes_not_utf8(self):
+        for data in ('"\u00e9"'.encode('utf-16'), b'"\xed\xa0\x80"'):
+            with self.subTest(data=data):
+                self.assertRaises(UnicodeDecodeError, jsonutils.loads, data)
+                self.assertRaises(UnicodeDecodeError, jsonutils.load,
+                                  io.BytesIO(data))
+        # A byte order mark is refused too, as the json module does.
+        for data in (codecs.BOM_UTF8 + b'[1]', '\ufeff[1]'):
+            with self.subTest(data=data):
+                self.assertRaises(ValueError, jsonutils.loads, data)
+
+    def test_loads_not_string(self):
+        for value in (None, 42):
+            with self.subTest(value=value):
+                self.assertRaises(TypeError, jsonutils.loads, value)
+
     def test_loads_with_kwargs(self):
         jsontext = '{"foo": 3}'
         result = jsonutils.loads(jsontext, parse_int=lambda x: 5)
         self.assertEqual(5, result['foo'])
 
+    def test_loads_non_standard(self):
+        self.assertTrue(math.isnan(jsonutils.loads('NaN')))
+        for big in (2 ** 64 + 1, -2 ** 63 - 1, 12345678901234567890123):
+            with self.subTest(big=big):
+                ret = jsonutils.loads(str(big))
+                self.assertIsInstance(ret, int)
+                self.assertEqual(big, ret)
+                ret = jsonutils.loads(b'{"id": %d}' % big)
+                self.assertIsInstance(ret['id'], int)
+                self.assertEqual({'id': big}, ret)
+        self.assertEqual({'a': float('inf')},
+                         jsonutils.loads(b'{"a": Infinity}'))
+
     def test_load(self):
 
         jsontext = '{"a": "\u0442\u044d\u0441\u0442"}'
@@ -116,105 +287,126 @@ class JSONUtilsTestMixin:
                 self.assertIsInstance(key, str)
                 self.assertIsInstance(val, str)
 
+    def test_load_utf8(self):
+        # UTF-8 is decoded strictly, without going through safe_decode().
+        jsontext = '{"a": "\u0442\u044d\u0441\u0442"}'.encode()
+        with mock.patch.object(jsonutils.encodeutils, 'safe_decode') as dec:
+            self.assertEqual({'a': '\u0442\u044d\u0441\u0442'},
+                             jsonutils.load(io.BytesIO(jsontext)))
+            self.assertRaises(ValueError, jsonutils.load,
+                              io.BytesIO(b'{"a": "\xff"}'))
+        dec.assert_not_called()
+
+    def test_loads_backend(self):
+        if jsonutils.orjson is not None:
+            target = (jsonutils.orjson, 'loads')
+        elif jsonutils.simdjson is not None:
+            target = (jsonutils, '_simdjson_loads')
+        else:
+            target = (jsonutils.json, 'loads')
+        with mock.patch.object(*target, wraps=getattr(*target)) as loads:
+            self.assertEqual({'a': 'b'}, jsonutils.loads(b'{"a": "b"}'))
+            self.assertEqual([1], jsonutils.load(io.BytesIO(b'[1]')))
+        self.assertEqual(2, loads.call_count)
+
     def test_dumps_exception_value(self):
         self.assertIn(jsonutils.dumps({"a": ValueError("hello")}),
                       ['{"a": "ValueError(\'hello\',)"}',
                        '{"a": "ValueError(\'hello\')"}'])
 
 
-class JSONUtilsTestJson(JSONUtilsTestMixin, test_base.BaseTestCase):
-    json_impl = json
-
-
 class ToPrimitiveTestCase(test_base.BaseTestCase):
-    def setUp(self):
-        super().setUp()
-        self.trans_fixture = self.useFixture(fixture.Translation())
-
-    def test_bytes(self):
-        self.assertEqual(jsonutils.to_primitive(b'abc'), 'abc')
-
-    def test_list(self):
-        self.assertEqual([1, 2, 3], jsonutils.to_primitive([1, 2, 3]))
+    _DT = datetime.datetime(1920, 2, 3, 4, 5, 6, 7)
+    _DT_ISO = '1920-02-03T04:05:06.000007'
+    _D = datetime.date(1920, 2, 3)
+    _D_ISO = '1920-02-03'
+    _XMLRPC_DT = xmlrpclib.DateTime('19710203T04:05:06')
+    _XMLRPC_DT_ISO = '1971-02-03T04:05:06.000000'
+    _NET_IP4 = netaddr.IPAddress('1.2.3.4')
+    _NET_NET = netaddr.IPNetwork('1.2.3.0/24')
+    _IPA_V4 = ipaddress.ip_address('192.168.0.1')
+    _IPA_V6 = ipaddress.ip_address('2001:db8::')
+    _PRIMITIVE_CASES = [
+        (b'abc', 'abc'),
+        ([1, 2, 3], [1, 2, 3]),
+        ([], []),
+        ((1, 2, 3), [1, 2, 3]),
+        (dict(a=1, b=2, c=3), dict(a=1, b=2, c=3)),
+        ({}, {}),
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # The Translation fixture has nothing to set up or clean up, its
+        # lazy messages can be shared by all the tests.
+        trans = fixture.Translation()
+        cls._lazy_messages = [
+            (trans.lazy('A message with param: %s'), 'test_domain'),
+            (trans.lazy('A message with params: %(param)s'),
+             {'param': 'hello'}),
+        ]
+
+    def test_primitive_conversions(self):
+        for src, expected in self._PRIMITIVE_CASES:
+            with self.subTest(src=src):
+                self.assertEqual(expected, jsonutils.to_primitive(src))
+
+    def test_nested(self):
+        x = {'a': [1, (2, {'b': [3]})], 'c': ({}, [])}
+        self.assertEqual({'a': [1, [2, {'b': [3]}]], 'c': [{}, []]},
+                         jsonutils.to_primitive(x))
 
-    def test_empty_list(self):
-        self.assertEqual([], jsonutils.to_primitive([]))
+    def test_nested_colliding_keys(self):
+        x = {'a': [1], b'a': 2}
+        self.assertEqual({'a': 2}, jsonutils.to_primitive(x))
 
-    def test_tuple(self):
-        self.assertEqual([1, 2, 3], jsonutils.to_primitive((1, 2, 3)))
+    def test_dict_subclass_items(self):
+        class ItemsDict(dict):
+            def items(self):
+                return [('over', 1)]
 
-    def test_dict(self):
-        self.assertEqual(dict(a=1, b=2, c=3),
-                         jsonutils.to_primitive(dict(a=1, b=2, c=3)))
+        self.assertEqual({'over': 1}, jsonutils.to_primitive(ItemsDict(a=1)))
 
-    def test_empty_dict(self):
-        self.assertEqual({}, jsonutils.to_primitive({}))
+    def test_list_with_cycle(self):
+        x = [1]
+        x.append([x])
+        self.assertRaises(RecursionError, jsonutils.to_primitive, x)
 
     def test_datetime(self):
-        x = datetime.datetime(1920, 2, 3, 4, 5, 6, 7)
-        self.assertEqual('1920-02-03T04:05:06.000007',
-                         jsonutils.to_primitive(x))
+        self.assertEqual(self._DT_ISO, jsonutils.to_primitive(self._DT))
+
+    def test_datetime_early_year(self):
+        self.assertEqual('0005-01-02T03:04:05.000006', jsonutils.to_primitive(
+            datetime.datetime(5, 1, 2, 3, 4, 5, 6)))
+        self.assertEqual('0005-01-02',
+                         jsonutils.to_primitive(datetime.date(5, 1, 2)))
 
     def test_datetime_preserve(self):
-        x = datetime.datetime(1920, 2, 3, 4, 5, 6, 7)
-        self.assertEqual(x, jsonutils.to_primitive(x, convert_datetime=False))
+        self.assertEqual(self._DT, jsonutils.to_primitive(
+            self._DT, convert_datetime=False))
 
     def test_date(self):
-        x = datetime.date(1920, 2, 3)
-        self.assertEqual('1920-02-03',
-                         jsonutils.to_primitive(x))
+        self.assertEqual(self._D_ISO, jsonutils.to_primitive(self._D))
 
     def test_date_preserve(self):
-        x = datetime.date(1920, 2, 3)
-        self.assertEqual(x, jsonutils.to_primitive(x, convert_datetime=False))
+        self.assertEqual(self._D, jsonutils.to_primitive(
+            self._D, convert_datetime=False))
 
     def test_DateTime(self):
-        x = xmlrpclib.DateTime()
-        x.decode("19710203T04:05:06")
-        self.assertEqual('1971-02-03T04:05:06.000000',
-                         jsonutils.to_primitive(x))
+        self.assertEqual(self._XMLRPC_DT_ISO,
+                         jsonutils.to_primitive(self._XMLRPC_DT))
 
     def test_iter(self):
-        class IterClass:
-            def __init__(self):
-                self.data = [1, 2, 3, 4, 5]
-                self.index = 0
-
-            def __iter__(self):
-                return self
-
-            def next(self):
-                if self.index == len(self.data):
-                    raise StopIteration
-                self.index = self.index + 1
-                return self.data[self.index - 1]
-            __next__ = next
-
         x = IterClass()
         self.assertEqual([1, 2, 3, 4, 5], jsonutils.to_primitive(x))
 
     def test_iteritems(self):
-        class IterItemsClass:
-            def __init__(self):
-                self.data = dict(a=1, b=2, c=3).items()
-                self.index = 0
-
-            def iteritems(self):
-                return self.data
-
         x = IterItemsClass()
         p = jsonutils.to_primitive(x)
         self.assertEqual({'a': 1, 'b': 2, 'c': 3}, p)
 
     def test_iteritems_with_cycle(self):
-        class IterItemsClass:
-            def __init__(self):
-                self.data = dict(a=1, b=2, c=3)
-                self.index = 0
-
-            def iteritems(self):
-                return self.data.items()
-
         x = IterItemsClass()
         x2 = IterItemsClass()
         x.data['other'] = x2
@@ -224,27 +416,85 @@ class ToPrimitiveTestCase(test_base.BaseTestCase):
         # an exception due to excessive recursion depth.
         jsonutils.to_primitive(x)
 
-    def test_items(self):
-        # Use items() when iteritems() is not available.
-        class ItemsClass:
+    def test_items_property_raising(self):
+        class IterPropertyClass:
+            @property
+            def items(self):
+                raise AttributeError('items')
+
+            def __iter__(self):
+                return iter([1, 2])
+
+        self.assertEqual([1, 2],
+                         jsonutils.to_primitive(IterPropertyClass()))
+
+    def test_items_with_deep_chain(self):
+        calls = []
+
+        class ChainItemsClass(ItemsClass):
+            __slots__ = ()
+
             def __init__(self):
-                self.data = dict(a=1, b=2, c=3)
+                self.data = {}
 
             def items(self):
-                return self.data.items()
+                calls.append(self)
+                return super().items()
+
+        nodes = [ChainItemsClass() for _ in range(10000)]
+        for a, b in zip(nodes, nodes[1:]):
+            a.data['next'] = b
+        nodes[-1].data['next'] = nodes[0]
+
+        # The work done is bounded by max_depth rather than by the length
+        # of the chain (or its cycle).
+        for max_depth in (3, 50):
+            with self.subTest(max_depth=max_depth):
+                del calls[:]
+                expected = None
+                for _ in range(max_depth):
+                    expected = {'next': expected}
+                self.assertEqual(expected, jsonutils.to_primitive(
+                    nodes[0], max_depth=max_depth))
+                self.assertEqual(nodes[:max_depth + 1], calls)
 
+    def test_items(self):
+        # Use items() when iteritems() is not available.
         x = ItemsClass()
         p = jsonutils.to_primitive(x)
         self.assertEqual({'a': 1, 'b': 2, 'c': 3}, p)
 
-    def test_precedence_items_iteritems(self):
-        class ItemsIterItemsClass:
-            def items(self):
-                return {'items': 'items'}
+    def test_instance_items(self):
+        # items() set on the instance rather than its class
+        x = InstanceItemsClass()
+        p = jsonutils.to_primitive(x)
+        self.assertEqual({'a': 1, 'b': 2, 'c': 3}, p)
+
+    def test_instance_items_before_class_iter(self):
+        # items() set on the instance wins over __iter__ of its class
+        class DictIterClass(IterClass):
+            pass
 
-            def iteritems(self):
-                return {'iteritems': 'iteritems'}
+        class GetattrIterClass(IterClass):
+            __slots__ = ()
 
+            def __getattr__(self, name):
+                if name == 'items':
+                    return {'k': 1}.items
+                raise AttributeError(name)
+
+        x = DictIterClass()
+        x.items = {'k': 1}.items
+        self.assertEqual({'k': 1}, jsonutils.to_primitive(x))
+        self.assertEqual({'k': 1}, jsonutils.to_primitive(GetattrIterClass()))
+        self.assertEqual([1, 2, 3, 4, 5], jsonutils.to_primitive(IterClass()))
+
+    def test_enum(self):
+        # Enum classes are iterable, not their members
+        x = enum.Enum('Color', 'RED')
+        self.assertRaises(ValueError, jsonutils.to_primitive, x.RED)
+
+    def test_precedence_items_iteritems(self):
         x = ItemsIterItemsClass()
         p = jsonutils.to_primitive(x)
         # Prefer iteritems over items
@@ -253,30 +503,11 @@ class ToPrimitiveTestCase(test_base.BaseTestCase):
     def test_mapping(self):
         # Make sure collections.abc.Mapping is converted to a dict
         # and not a list.
-        class MappingClass(collections.abc.Mapping):
-            def __init__(self):
-                self.data = dict(a=1, b=2, c=3)
-
-            def __getitem__(self, val):
-                return self.data[val]
-
-            def __iter__(self):
-                return iter(self.data)
-
-            def __len__(self):
-                return len(self.data)
-
         x = MappingClass()
         p = jsonutils.to_primitive(x)
         self.assertEqual({'a': 1, 'b': 2, 'c': 3}, p)
 
     def test_instance(self):
-        class MysteryClass:
-            a = 10
-
-            def __init__(self):
-                self.b = 1
-
         x = MysteryClass()
         self.assertEqual(dict(b=1),
                          jsonutils.to_primitive(x, convert_instances=True))
@@ -301,123 +532,137 @@ class ToPrimitiveTestCase(test_base.BaseTestCase):
         self.assertEqual('<built-in function dir>', ret[2])
 
     def test_depth(self):
-        class LevelsGenerator:
-            def __init__(self, levels):
-                self._levels = levels
-
-            def iteritems(self):
-                if self._levels == 0:
-                    return iter([])
-                else:
-                    return iter([(0, LevelsGenerator(self._levels - 1))])
-
         l4_obj = LevelsGenerator(4)
 
-        json_l2 = {0: {0: None}}
-        json_l3 = {0: {0: {0: None}}}
-        json_l4 = {0: {0: {0: {0: None}}}}
-
-        ret = jsonutils.to_primitive(l4_obj, max_depth=2)
-        self.assertEqual(json_l2, ret)
-
-        ret = jsonutils.to_primitive(l4_obj, max_depth=3)
-        self.assertEqual(json_l3, ret)
-
-        ret = jsonutils.to_primitive(l4_obj, max_depth=4)
-        self.assertEqual(json_l4, ret)
-
-    def test_ipaddr_using_netaddr(self):
-        thing = {'ip_addr': netaddr.IPAddress('1.2.3.4')}
-        ret = jsonutils.to_primitive(thing)
-        self.assertEqual({'ip_addr': '1.2.3.4'}, ret)
-
-    def test_ipaddr_using_ipaddress_v4(self):
-        thing = {'ip_addr': ipaddress.ip_address('192.168.0.1')}
-        ret = jsonutils.to_primitive(thing)
-        self.assertEqual({'ip_addr': '192.168.0.1'}, ret)
-
-    def test_ipaddr_using_ipaddress_v6(self):
-        thing = {'ip_addr': ipaddress.ip_address('2001:db8::')}
-        ret = jsonutils.to_primitive(thing)
-        self.assertEqual({'ip_addr': '2001:db8::'}, ret)
-
-    def test_ipnet_using_netaddr(self):
-        thing = {'ip_net': netaddr.IPNetwork('1.2.3.0/24')}
-        ret = jsonutils.to_primitive(thing)
-        self.assertEqual({'ip_net': '1.2.3.0/24'}, ret)
-
-    def test_message_with_param(self):
-        msg = self.trans_fixture.lazy('A message with param: %s')
-        msg = msg % 'test_domain'
-        ret = jsonutils.to_primitive(msg)
-        self.assertEqual(msg, ret)
-
-    def test_message_with_named_param(self):
-        msg = self.trans_fixture.lazy('A message with params: %(param)s')
-        msg = msg % {'param': 'hello'}
-        ret = jsonutils.to_primitive(msg)
-        self.assertEqual(msg, ret)
+        for max_depth in (2, 3, 4):
+            with self.subTest(max_depth=max_depth):
+                ret = jsonutils.to_primitive(l4_obj, max_depth=max_depth)
+                self.assertEqual(_expected(max_depth), ret)
+
+    def test_ipaddr(self):
+        for thing, expected in [
+            (self._NET_IP4, '1.2.3.4'),
+            (self._IPA_V4, '192.168.0.1'),
+            (self._IPA_V6, '2001:db8::'),
+            (self._NET_NET, '1.2.3.0/24'),
+        ]:
+            with self.subTest(thing=thing):
+                ret = jsonutils.to_primitive({'ip_addr': thing})
+                self.assertEqual({'ip_addr': expected}, ret)
+
+    def test_message(self):
+        for lazy_msg, param in self._lazy_messages:
+            with self.subTest(msgid=lazy_msg.msgid):
+                msg = lazy_msg % param
+                ret = jsonutils.to_primitive(msg)
+                self.assertEqual(msg, ret)
 
     def test_fallback(self):
-        obj = ReprObject()
-
-        self.assertRaises(ValueError, jsonutils.to_primitive, obj)
+        obj = _REPR_OBJ
+        for value, expected in [(obj, 'repr'), ([obj], ['repr'])]:
+            with self.subTest(value=value):
+                self.assertRaises(ValueError, jsonutils.to_primitive, value)
 
-        ret = jsonutils.to_primitive(obj, fallback=repr)
-        self.assertEqual('repr', ret)
+                ret = jsonutils.to_primitive(value, fallback=repr)
+                self.assertEqual(expected, ret)
 
-    def test_fallback_list(self):
-        obj = ReprObject()
-        obj_list = [obj]
-
-        self.assertRaises(ValueError, jsonutils.to_primitive, obj_list)
-
-        ret = jsonutils.to_primitive(obj_list, fallback=repr)
-        self.assertEqual(['repr'], ret)
-
-    def test_fallback_itertools_count(self):
-        obj = itertools.count(1)
-
-        ret = jsonutils.to_primitive(obj)
-        self.assertEqual(str(obj), ret)
+    def test_partial(self):
+        def plain():
+            pass
 
-        ret = jsonutils.to_primitive(obj, fallback=lambda _: 'itertools_count')
-        self.assertEqual('itertools_count', ret)
+        def gen():
+            yield 1
+
+        for funcs in ((plain, gen), (gen, plain)):
+            jsonutils._nasty_types.clear()
+            for func in funcs:
+                value = functools.partial(func)
+                with self.subTest(func=func.__name__):
+                    if func is gen:
+                        self.assertEqual(str(value),
+                                         jsonutils.to_primitive(value))
+                    else:
+                        self.assertRaises(ValueError,
+                                          jsonutils.to_primitive, value)
+
+    def test_proxy(self):
+        class Proxy:
+            def __init__(self, wrapped):
+                self._wrapped = wrapped
+
+            @property
+            def __class__(self):
+                return type(self._wrapped)
+
+            def __getattr__(self, name):
+                return getattr(self._wrapped, name)
 
-    def test_fallback_nasty(self):
-        obj = int
-        ret = jsonutils.to_primitive(obj)
-        self.assertEqual(str(obj), ret)
+            def __iter__(self):
+                return iter(self._wrapped)
 
-        def formatter(typeobj):
-            return 'type:%s' % typeobj.__name__
-        ret = jsonutils.to_primitive(obj, fallback=formatter)
-        self.assertEqual("type:int", ret)
+        func = Proxy(len)
+        self.assertEqual(str(func), jsonutils.to_primitive(func))
+        self.assertEqual({'a': 1}, jsonutils.to_primitive(Proxy({'a': 1})))
 
-    def test_fallback_typeerror(self):
+    def test_fallback_str(self):
         class NotIterable:
-            # __iter__ is not callable, cause a TypeError in to_primitive()
+            # __iter__ set to None, the class is not iterable
             __iter__ = None
 
-        obj = NotIterable()
-
-        ret = jsonutils.to_primitive(obj)
-        self.assertEqual(str(obj), ret)
-
-        ret = jsonutils.to_primitive(obj, fallback=lambda _: 'fallback')
-        self.assertEqual('fallback', ret)
-
-    def test_fallback_typeerror_IO_object(self):
-        # IO Objects are not callable, cause a TypeError in to_primitive()
-        obj = io.IOBase
-
-        ret = jsonutils.to_primitive(obj)
-        self.assertEqual(str(obj), ret)
+        def formatter(value):
+            return ('fallback', value)
+
+        for obj in [
+            itertools.count(1),
+            # Nasty
+            int,
+            NotIterable(),
+            # IO Objects are not callable, cause a TypeError in
+            # to_primitive()
+            io.IOBase,
+        ]:
+            with self.subTest(obj=obj):
+                ret = jsonutils.to_primitive(obj)
+                self.assertEqual(str(obj), ret)
+
+                ret = jsonutils.to_primitive(obj, fallback=formatter)
+                self.assertEqual(('fallback', obj), ret)
+
+    def test_fallback_not_iterable(self):
+        class NotIterable:
+            __iter__ = None
 
-        ret = jsonutils.to_primitive(obj, fallback=lambda _: 'fallback')
-        self.assertEqual('fallback', ret)
+        class InstanceIter:
+            def __init__(self):
+                # Not used by iter(), which only looks at the class
+                self.__iter__ = lambda: iter([1])
+
+        class GetItem(InstanceIter):
+            def __getitem__(self, index):
+                if index > 1:
+                    raise IndexError(index)
+                return index
+
+        with mock.patch.object(jsonutils, '_container_to_primitive',
+                               wraps=jsonutils._container_to_primitive) as c:
+            for obj in (NotIterable(), InstanceIter()):
+                with self.subTest(obj=obj):
+                    ret = jsonutils.to_primitive(obj, fallback=repr)
+                    self.assertEqual(repr(obj), ret)
+            c.assert_not_called()
+            self.assertEqual([0, 1], jsonutils.to_primitive(GetItem()))
 
     def test_exception(self):
         self.assertIn(jsonutils.to_primitive(ValueError("an exception")),
                       ["ValueError('an exception',)",
                        "ValueError('an exception')"])
+
+
+class JSONSerializerTestCase(test_base.BaseTestCase):
+    def test_dump_default(self):
+        serializer = json_serializer.JSONSerializer(default=repr)
+        obj = {'a': _REPR_OBJ}
+        fp = io.StringIO()
+        serializer.dump(obj, fp)
+        self.assertEqual('{"a": "repr"}', fp.getvalue())
+        self.assertEqual(b'{"a": "repr"}', serializer.dump_as_bytes(obj))
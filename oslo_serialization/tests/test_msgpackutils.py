@@ -12,10 +12,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import copy
 import datetime
+import io
 import itertools
+import unittest
+import uuid
 from xmlrpc import client as xmlrpclib
 
+import msgpack
 import netaddr
 from oslotest import base as test_base
 
@@ -27,6 +32,7 @@ except ImportError:
     zoneinfo = None
 
 from oslo_serialization import msgpackutils
+from oslo_serialization.serializer import msgpack_serializer
 from oslo_utils import uuidutils
 
 
@@ -105,6 +111,24 @@ class MsgPackUtilsTest(test_base.BaseTestCase):
         }
         self.assertEqual(src, _dumps_loads(src))
 
+    def test_uuid(self):
+        x = uuid.uuid4()
+        self.assertEqual(x, _dumps_loads(x))
+
+    def test_uuid_hex(self):
+        x = uuid.UUID(int=1)
+        blob = msgpack.packb(
+            msgpack.ExtType(msgpackutils.UUIDHandler.identity,
+                            x.hex.encode('ascii')))
+        self.assertEqual(blob, msgpackutils.dumps(x))
+        self.assertEqual(x, msgpackutils.loads(blob))
+
+    def test_uuid_bytes(self):
+        x = uuid.uuid4()
+        blob = msgpack.packb(
+            msgpack.ExtType(msgpackutils.UUIDHandler.identity, x.bytes))
+        self.assertEqual(x, msgpackutils.loads(blob))
+
     def test_itercount(self):
         it = itertools.count(1)
         next(it)
@@ -133,6 +157,10 @@ class MsgPackUtilsTest(test_base.BaseTestCase):
     def test_empty_frozenset(self):
         self.assertEqual(frozenset([]), _dumps_loads(frozenset([])))
 
+    def test_nested_sets(self):
+        x = {frozenset([1, frozenset([2])]), 3}
+        self.assertEqual(x, _dumps_loads(x))
+
     def test_datetime_preserve(self):
         x = datetime.datetime(1920, 2, 3, 4, 5, 6, 7)
         self.assertEqual(x, _dumps_loads(x))
@@ -142,6 +170,15 @@ class MsgPackUtilsTest(test_base.BaseTestCase):
         x.decode("19710203T04:05:06")
         self.assertEqual(x, _dumps_loads(x))
 
+    def test_datetime_payload(self):
+        registry = msgpackutils.default_registry
+        handler = registry.match(xmlrpclib.DateTime())
+        dt_handler = registry.match(datetime.datetime.now())
+        for dt in (datetime.datetime(1971, 2, 3, 4, 5, 6),
+                   datetime.datetime(99, 12, 31, 23, 59, 59)):
+            self.assertEqual(dt_handler.serialize(dt),
+                             handler.serialize(xmlrpclib.DateTime(dt)))
+
     def test_ipaddr(self):
         thing = {'ip_addr': netaddr.IPAddress('1.2.3.4')}
         self.assertEqual(thing, _dumps_loads(thing))
@@ -200,6 +237,91 @@ class MsgPackUtilsTest(test_base.BaseTestCase):
         h = registry.match(set())
         self.assertIsInstance(h, MySpecialSetHandler)
 
+    def test_get(self):
+        registry = msgpackutils.default_registry.copy(unfreeze=True)
+        h = registry.get(msgpackutils.SetHandler.identity)
+        self.assertIsInstance(h, msgpackutils.SetHandler)
+        self.assertIsNone(registry.get(ColorHandler.identity))
+        self.assertIsNone(registry.get(-1))
+        self.assertIsNone(registry.get(128))
+        registry.register(ColorHandler())
+        h = registry.get(ColorHandler.identity)
+        self.assertIsInstance(h, ColorHandler)
+
+    def test_unknown_extension(self):
+        for code in (ColorHandler.identity, 127):
+            ext = msgpack.ExtType(code, b'abc')
+            self.assertEqual(ext, msgpackutils.loads(msgpack.packb(ext)))
+        # msgpack.ExtType() only accepts codes from 0 to 127.
+        self.assertRaises(ValueError, msgpackutils.loads, b'\xd4\xfe\x00')
+
+    def test_match_then_register(self):
+        registry = msgpackutils.default_registry.copy(unfreeze=True)
+        h = registry.match(set())
+        self.assertIsInstance(h, msgpackutils.SetHandler)
+        registry.register(MySpecialSetHandler(),
+                          reserved=True, override=True)
+        h = registry.match(set())
+        self.assertIsInstance(h, MySpecialSetHandler)
+
+    def test_handlers_slots(self):
+        for h in msgpackutils.default_registry:
+            self.assertFalse(hasattr(h, '__dict__'), h)
+
+    def test_match(self):
+        registry = msgpackutils.default_registry
+        self.assertIsInstance(registry.match(datetime.datetime.now()),
+                              msgpackutils.DateTimeHandler)
+        self.assertIsInstance(registry.match(datetime.date.today()),
+                              msgpackutils.DateHandler)
+        self.assertIsInstance(registry.match(frozenset()),
+                              msgpackutils.FrozenSetHandler)
+        self.assertIsNone(registry.match(object()))
+
+    def test_match_proxy(self):
+        class Proxy:
+            def __init__(self, wrapped):
+                self._wrapped = wrapped
+
+            @property
+            def __class__(self):
+                return type(self._wrapped)
+
+            def __getattr__(self, name):
+                return getattr(self._wrapped, name)
+
+        dt = datetime.datetime(2016, 1, 1, 1, 1, 1)
+        self.assertEqual(dt, _dumps_loads(Proxy(dt)))
+        self.assertIsInstance(
+            msgpackutils.default_registry.match(Proxy(frozenset())),
+            msgpackutils.FrozenSetHandler)
+
+    def test_no_match_then_register(self):
+        registry = msgpackutils.default_registry.copy(unfreeze=True)
+        c = Color(1, 2, 3)
+        self.assertIsNone(registry.match(c))
+        self.assertIsNone(registry.match(c))
+        registry.register(ColorHandler())
+        self.assertIsInstance(registry.match(c), ColorHandler)
+
+    def test_match_index_bounded(self):
+        registry = msgpackutils.default_registry.copy()
+        for i in range(msgpackutils._TYPE_INDEX_MAX * 2):
+            self.assertIsNone(registry.match(type('T%d' % i, (), {})()))
+        self.assertLessEqual(len(registry._type_index),
+                             msgpackutils._TYPE_INDEX_MAX)
+        self.assertIsInstance(registry.match(datetime.datetime.now()),
+                              msgpackutils.DateTimeHandler)
+
+    def test_freeze(self):
+        registry = msgpackutils.default_registry.copy(unfreeze=True)
+        self.assertFalse(registry.frozen)
+        registry.freeze()
+        self.assertTrue(registry.frozen)
+        self.assertRaises(ValueError, registry.register, ColorHandler())
+        self.assertTrue(registry.copy().frozen)
+        self.assertIsNone(registry.match(Color(1, 2, 3)))
+
     def test_bad_register(self):
         registry = msgpackutils.default_registry
         self.assertRaises(ValueError,
@@ -227,3 +349,95 @@ class MsgPackUtilsTest(test_base.BaseTestCase):
 
     def test_object(self):
         self.assertRaises(ValueError, msgpackutils.dumps, object())
+
+    def test_dump_load(self):
+        fp = io.BytesIO()
+        msgpackutils.dump({'a': {1, 2}}, fp)
+        fp.seek(0)
+        self.assertEqual({'a': {1, 2}}, msgpackutils.load(fp))
+
+    def test_dumps_many(self):
+        objs = [1, {'a': datetime.date(2016, 1, 1)}, {2, 3}, 'b']
+        blob = msgpackutils.dumps_many(objs)
+        self.assertEqual(b''.join(msgpackutils.dumps(o) for o in objs), blob)
+        self.assertEqual(b'', msgpackutils.dumps_many([]))
+
+    def test_dumps_after_error(self):
+        self.assertRaises(ValueError, msgpackutils.dumps, [1, object()])
+        self.assertEqual([1, 2], _dumps_loads([1, 2]))
+
+    def test_deepcopy(self):
+        registry = msgpackutils.default_registry.copy()
+        msgpackutils.dumps({1, 2}, registry=registry)
+        registry = copy.deepcopy(registry)
+        blob = msgpackutils.dumps({1, 2}, registry=registry)
+        self.assertEqual({1, 2}, msgpackutils.loads(blob, registry=registry))
+
+    def test_large_dumps_packer_not_kept(self):
+        registry = msgpackutils.default_registry.copy()
+        msgpackutils.dumps([1, 2], registry=registry)
+        packer = registry._packers.packer
+        msgpackutils.dumps([3, 4], registry=registry)
+        self.assertIs(packer, registry._packers.packer)
+        big = b'x' * (msgpackutils._PACKER_KEEP_MAX + 1)
+        self.assertEqual(big, msgpackutils.loads(
+            msgpackutils.dumps(big, registry=registry), registry=registry))
+        self.assertIsNone(registry._packers.packer)
+        self.assertEqual([1, 2], msgpackutils.loads(
+            msgpackutils.dumps([1, 2], registry=registry)))
+        self.assertIsNotNone(registry._packers.packer)
+
+
+@unittest.skipIf(msgpack_serializer.msgspec is None,
+                 'msgspec is not installed')
+class MessagePackSerializerFastTest(test_base.BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.serializer = msgpack_serializer.MessagePackSerializer(fast=True)
+
+    def test_plain(self):
+        obj = {'a': [1, 2.5, None, True], 'b': 'c', 'd': b'e'}
+        blob = self.serializer.dump_as_bytes(obj)
+        self.assertEqual(msgpackutils.dumps(obj), blob)
+        self.assertEqual(obj, self.serializer.load_from_bytes(blob))
+
+    def test_registry_extension(self):
+        obj = {'count': itertools.count(3),
+               'ip': netaddr.IPAddress('1.2.3.4')}
+        blob = self.serializer.dump_as_bytes(obj)
+        self.assertEqual(msgpackutils.dumps(obj), blob)
+        loaded = self.serializer.load_from_bytes(blob)
+        self.assertEqual(3, next(loaded['count']))
+        self.assertEqual(obj['ip'], loaded['ip'])
+
+    def test_load_extensions(self):
+        obj = {'u': uuid.uuid4(), 's': {1, 2},
+               'd': datetime.datetime(2016, 1, 1, 1, 1, 1)}
+        blob = msgpackutils.dumps(obj)
+        self.assertEqual(obj, self.serializer.load_from_bytes(blob))
+        self.assertEqual(obj, self.serializer.load(io.BytesIO(blob)))
+
+    def test_round_trip_registry_types(self):
+        obj = {'u': uuid.uuid4(), 's': {1, 2}, 'f': frozenset([3]),
+               'dt': datetime.datetime(2016, 1, 1, 1, 1, 1),
+               'd': datetime.date(2016, 1, 1)}
+        blob = self.serializer.dump_as_bytes(obj)
+        self.assertEqual(msgpackutils.dumps(obj), blob)
+        loaded = self.serializer.load_from_bytes(blob)
+        self.assertEqual(obj, loaded)
+        for key, value in obj.items():
+            self.assertIs(type(value), type(loaded[key]))
+        self.assertEqual(blob, self.serializer.dump_many([obj]))
+        fp = io.BytesIO()
+        self.serializer.dump(obj, fp)
+        self.assertEqual(obj, self.serializer.load(io.BytesIO(fp.getvalue())))
+
+    def test_load_stream(self):
+        fp = io.BytesIO(self.serializer.dump_many([1, 2]))
+        self.assertEqual(1, self.serializer.load(fp))
+
+    def test_deepcopy(self):
+        serializer = copy.deepcopy(self.serializer)
+        self.assertIsNotNone(serializer._decoder)
+        blob = serializer.dump_as_bytes({1, 2})
+        self.assertEqual({1, 2}, serializer.load_from_bytes(blob))